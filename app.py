@@ -1,9 +1,25 @@
 import streamlit as st
 import pandas as pd
-import random
+import numpy as np
+import csv
+import re
+import time
+import hashlib
+import json
+import asyncio
+import threading
 import anthropic
 import requests
-from io import StringIO
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from cachetools import TTLCache
+from io import BufferedReader
+from pathlib import Path
+
+try:
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa_csv = None
 
 # Set page configuration
 st.set_page_config(
@@ -12,57 +28,18 @@ st.set_page_config(
     layout="wide"
 )
 
-# Function to call Claude API
-def call_claude_api(client, user_message, conversation_history=""):
-    """Call the Anthropic Claude API using the Python client and return the assistant's response."""
-    try:
-        # Create messages list for the API
-        messages = []
-        
-        # Add conversation history if provided
-        if conversation_history:
-            # Parse conversation history into proper message format
-            history_lines = conversation_history.strip().split('\n')
-            current_role = None
-            current_content = []
-            
-            for line in history_lines:
-                if line.startswith("User: "):
-                    # If we were building a previous message, add it
-                    if current_role and current_content:
-                        messages.append({"role": current_role, "content": "\n".join(current_content)})
-                        current_content = []
-                    
-                    current_role = "user"
-                    current_content = [line[6:]]  # Remove "User: " prefix
-                elif line.startswith("Assistant: "):
-                    # If we were building a previous message, add it
-                    if current_role and current_content:
-                        messages.append({"role": current_role, "content": "\n".join(current_content)})
-                        current_content = []
-                    
-                    current_role = "assistant"
-                    current_content = [line[11:]]  # Remove "Assistant: " prefix
-                elif line.startswith('-' * 80):
-                    # Separator line, ignore
-                    continue
-                else:
-                    # Continuation of current message
-                    if current_role:
-                        current_content.append(line)
-            
-            # Add the last message if there is one
-            if current_role and current_content:
-                messages.append({"role": current_role, "content": "\n".join(current_content)})
-        
-        # Add the current user message
-        messages.append({"role": "user", "content": user_message})
-        
-        # Use the Python client to create a message
-        response = client.messages.create(
-            model="claude-3-7-sonnet-latest",
-            max_tokens=1024,
-            system="""You are an AI assistant trained to help expand the reach of Community Notes on X (formerly Twitter) by providing helpful, informative, and accurate context to posts that might be misleading or missing important context.
+# On-disk cache for the cleaned data, so cold starts can skip the CSV download and parse
+DATA_CACHE_DIR = Path.home() / ".streamlit" / "cache"
+DATA_CACHE_TTL = 3600  # seconds
+
+# Columns the app reads from the data
+DATA_COLUMNS = ['tweet_content', 'summary']
+
+# How much of the CSV to look at when detecting the delimiter and header
+CSV_SNIFF_BYTES = 65536
+
+# System prompt sent with every request
+SYSTEM_PROMPT = """You are an AI assistant trained to help expand the reach of Community Notes on X (formerly Twitter) by providing helpful, informative, and accurate context to posts that might be misleading or missing important context.
 
 Your goal is to write notes that people from different points of view would find helpful. Focus on accuracy and factual information, providing sources when possible.
 
@@ -76,18 +53,489 @@ Key guidelines:
 - Avoid partisan language or taking sides on controversial issues
 - Only add context when it meaningfully improves understanding
 
-If you're unsure about the accuracy of information, err on the side of caution.""",
-            messages=messages
-        )
+If you're unsure about the accuracy of information, err on the side of caution."""
+
+# Models used to answer posts: short plain posts go to the faster, cheaper model
+DEFAULT_MODEL = "claude-3-7-sonnet-latest"
+FAST_MODEL = "claude-3-5-haiku-latest"
+SIMPLE_INPUT_MAX_CHARS = 280
+URL_PATTERN = re.compile(r"https?://|www\.", re.IGNORECASE)
+DIGIT_RUN_PATTERN = re.compile(r"\d{2,}")
+
+# Budgets for the few-shot examples prepended to every request, in characters
+MAX_EXAMPLE_CHARS = 1500
+MAX_EXAMPLES_TOTAL_CHARS = 20_000
+
+# Streaming: give up if no data arrives for this long, and redraw the partial response every few chunks
+STREAM_STALL_TIMEOUT = 30  # seconds
+STREAM_RENDER_EVERY = 5  # chunks
+
+# Line between examples in the context examples transcript
+EXAMPLE_SEPARATOR = "\n" + "-" * 80 + "\n"
+
+# Built transcripts are memoized for an hour, keeping at most this many
+HISTORY_CACHE_TTL = 3600  # seconds
+HISTORY_CACHE_MAX_ENTRIES = 100
+
+# Generated notes are cached in memory for a day, keeping at most this many
+NOTE_CACHE_TTL = 86400  # seconds
+NOTE_CACHE_MAX_ENTRIES = 1000
+
+# The API key check runs alongside the data download and must never outlast it
+KEY_CHECK_TIMEOUT = 5  # seconds
+
+# How often to check on a submitted Message Batch
+BATCH_POLL_INTERVAL = 5  # seconds
+
+# Maximum number of requests in flight when analyzing samples concurrently
+ANALYZE_CONCURRENCY = 10
+
+# Function to check whether a post is simple enough for the fast model
+def _is_simple(user_message):
+    """Return True for short posts without links or numbers, which rarely need a detailed note."""
+    return (
+        len(user_message) < SIMPLE_INPUT_MAX_CHARS
+        and not URL_PATTERN.search(user_message)
+        and not DIGIT_RUN_PATTERN.search(user_message)
+    )
+
+# Function to build the Messages API parameters for a post
+def build_request_params(user_message, history_messages=None):
+    """Return the model, system prompt and messages used to request a note for user_message."""
+    # Create messages list for the API from the pre-built example messages and the current user message
+    messages = list(history_messages or [])
+    
+    # Mark the end of the examples as a prompt-cache breakpoint so the shared prefix is reused across turns
+    if messages:
+        last = messages[-1]
+        messages[-1] = {
+            "role": last["role"],
+            "content": [{"type": "text", "text": last["content"], "cache_control": {"type": "ephemeral"}}]
+        }
+    
+    messages.append({"role": "user", "content": user_message})
+    
+    # Route simple posts to the fast model and everything else to the default model
+    model = FAST_MODEL if _is_simple(user_message) else DEFAULT_MODEL
+    
+    return dict(
+        model=model,
+        max_tokens=1024,
+        system=[{"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}],
+        messages=messages
+    )
+
+# Function to get the cache of generated notes, shared across reruns, sessions and API keys
+@st.cache_resource
+def get_note_cache():
+    """Return the process-wide TTL cache of generated notes keyed by request_cache_key, and the lock guarding it."""
+    return TTLCache(maxsize=NOTE_CACHE_MAX_ENTRIES, ttl=NOTE_CACHE_TTL), threading.Lock()
+
+# Function to look up a generated note
+def get_cached_note(key):
+    """Return the cached note for key, or None if there is none or it has expired."""
+    cache, lock = get_note_cache()
+    with lock:
+        return cache.get(key)
+
+# Function to remember a generated note
+def store_note(key, note):
+    """Cache note under key, evicting expired and least recently used notes as needed."""
+    cache, lock = get_note_cache()
+    with lock:
+        cache[key] = note
+
+# Function to identify a request for caching
+def request_cache_key(params):
+    """Return a hash of the request parameters, covering the model, system prompt and messages."""
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+# Function to call Claude API
+def call_claude_api(client, user_message, history_messages=None, placeholder=None):
+    """Call the Anthropic Claude API using the Python client, streaming into placeholder if given, and return the assistant's response."""
+    try:
+        params = build_request_params(user_message, history_messages)
+        
+        # Serve repeated requests from the note cache without calling the API
+        key = request_cache_key(params)
+        cached_note = get_cached_note(key)
+        if cached_note is not None:
+            if placeholder is not None:
+                placeholder.markdown(cached_note)
+            return cached_note
+        
+        # Use the Python client to stream the message so tokens can be shown as they arrive.
+        # The timeout applies to each read, so a stalled connection fails fast instead of hanging.
+        chunks = []
+        with client.messages.stream(**params, timeout=STREAM_STALL_TIMEOUT) as stream:
+            for text in stream.text_stream:
+                chunks.append(text)
+                if placeholder is not None and len(chunks) % STREAM_RENDER_EVERY == 0:
+                    placeholder.markdown("".join(chunks))
         
-        # Extract the text content from the response
-        if response.content and len(response.content) > 0:
-            return response.content[0].text
+        if placeholder is not None:
+            placeholder.markdown("".join(chunks))
+        
+        # Return the accumulated text content from the response
+        if chunks:
+            note = "".join(chunks)
+            store_note(key, note)
+            return note
         else:
             return "No response content received."
     except Exception as e:
         raise Exception(f"API request failed: {str(e)}")
 
+# Function to identify the API key a batch was submitted under without keeping the key itself
+def api_key_hash(api_key):
+    """Return a hash of api_key for comparing keys stored in session state."""
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+# Function to check for a batch left pending by an earlier run
+def pending_note_batch(job_key, api_key):
+    """Return whether st.session_state[job_key] holds a batch submitted under api_key, forgetting one submitted under another key."""
+    job = st.session_state.get(job_key)
+    if job is not None and job.get("key_hash") != api_key_hash(api_key or ""):
+        del st.session_state[job_key]
+        job = None
+    return job is not None
+
+# Function to cancel a batch left pending by an earlier run
+def forget_note_batch(job_key, api_key):
+    """Forget the batch tracked in st.session_state[job_key], asking the API to cancel it if it is still running."""
+    job = st.session_state.pop(job_key, None)
+    if job is not None and api_key:
+        try:
+            get_client(api_key).messages.batches.cancel(job["batch_id"])
+        except Exception:
+            # The batch may already have ended or belong to another key, it is forgotten either way
+            pass
+
+# Function to tell errors worth retrying on the next rerun from permanent ones
+def _is_transient(error):
+    """Return True for connection errors, rate limits and server errors, which may succeed if retried."""
+    if isinstance(error, anthropic.APIConnectionError):
+        return True
+    return isinstance(error, anthropic.APIStatusError) and (error.status_code == 429 or error.status_code >= 500)
+
+# Function to generate notes for many posts with the Message Batches API
+def run_note_batch(client, job_key, posts, history_messages=None, poll_interval=BATCH_POLL_INTERVAL, on_progress=None):
+    """Submit the posts without a cached note as one Message Batch, wait for it to finish and return the posts and notes in input order.
+
+    The submitted batch is tracked in st.session_state[job_key] until its results are collected, so a rerun while
+    polling resumes that batch and its posts instead of submitting a new one. The batch is forgotten if it was
+    submitted under another API key or fails with an error that retrying would not fix.
+    """
+    key_hash = api_key_hash(client.api_key)
+    try:
+        job = st.session_state.get(job_key)
+        if job is not None and job.get("key_hash") != key_hash:
+            job = None
+        if job is None:
+            notes = {}
+            keys = []
+            batch_requests = []
+            for i, post in enumerate(posts):
+                params = build_request_params(post, history_messages)
+                keys.append(request_cache_key(params))
+                cached_note = get_cached_note(keys[-1])
+                if cached_note is not None:
+                    notes[i] = cached_note
+                else:
+                    batch_requests.append({"custom_id": f"post-{i}", "params": params})
+            
+            job = {
+                "posts": list(posts), "keys": keys, "notes": notes, "batch_id": None,
+                "size": len(batch_requests), "key_hash": key_hash
+            }
+            if batch_requests:
+                job["batch_id"] = client.messages.batches.create(requests=batch_requests).id
+                st.session_state[job_key] = job
+        
+        notes = job["notes"]
+        if job["batch_id"] is not None:
+            # Batches are processed asynchronously, so poll until every request has finished
+            batch = client.messages.batches.retrieve(job["batch_id"])
+            while batch.processing_status != "ended":
+                if on_progress is not None:
+                    on_progress(1 - batch.request_counts.processing / job["size"])
+                time.sleep(poll_interval)
+                batch = client.messages.batches.retrieve(batch.id)
+            
+            # Results can come back in any order, so match them to posts by custom_id and only cache successes
+            for entry in client.messages.batches.results(batch.id):
+                index = int(entry.custom_id.split("-")[1])
+                if entry.result.type == "succeeded" and entry.result.message.content:
+                    notes[index] = entry.result.message.content[0].text
+                    store_note(job["keys"][index], notes[index])
+                else:
+                    notes[index] = f"Request {entry.result.type}."
+            del st.session_state[job_key]
+        
+        return job["posts"], [notes.get(i, "No response content received.") for i in range(len(job["posts"]))]
+    except Exception as e:
+        # Keep the batch for the next rerun only if the error may go away, otherwise every rerun would fail the same way
+        if not _is_transient(e):
+            st.session_state.pop(job_key, None)
+        raise Exception(f"Batch request failed: {str(e)}")
+
+# Function to generate notes for many posts with concurrent requests
+async def analyze_batch(prompts, api_key, concurrency=ANALYZE_CONCURRENCY, on_progress=None):
+    """Request a note for every prompt with at most concurrency requests in flight and return the notes in input order."""
+    client = anthropic.AsyncAnthropic(api_key=api_key)
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def analyze(index, prompt):
+        params = build_request_params(prompt)
+        key = request_cache_key(params)
+        note = get_cached_note(key)
+        if note is None:
+            # Report a failed request in its own row so the other notes are kept and still in flight requests finish
+            try:
+                async with semaphore:
+                    response = await client.messages.create(**params)
+            except Exception as e:
+                return index, f"API request failed: {str(e)}"
+            if not response.content:
+                return index, "No response content received."
+            note = response.content[0].text
+            store_note(key, note)
+        return index, note
+    
+    notes = [None] * len(prompts)
+    try:
+        # Fill in notes as requests finish so progress can be reported
+        for done, next_result in enumerate(asyncio.as_completed([analyze(i, p) for i, p in enumerate(prompts)]), start=1):
+            index, note = await next_result
+            notes[index] = note
+            if on_progress is not None:
+                on_progress(done / len(prompts))
+    finally:
+        await client.close()
+    return notes
+
+# Function to get the Anthropic client for an API key
+@st.cache_resource
+def get_client(api_key):
+    """Return the Anthropic client for api_key, built once per key so its connection pool is reused across reruns."""
+    return anthropic.Anthropic(api_key=api_key, max_retries=2)
+
+# Function to get the shared HTTP session used for data downloads
+@st.cache_resource
+def get_http_session():
+    """Return a requests.Session that keeps connections alive across reruns and retries transient failures."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=Retry(total=3, backoff_factor=0.5))
+    session.mount("https://", adapter)
+    return session
+
+# Function to download, parse and clean the CSV data
+def fetch_csv_data(url):
+    """Download the CSV at url and return a DataFrame of the valid tweet_content/summary rows and whether its columns were renamed."""
+    # Download the CSV file from URL, streaming it into the parser instead of holding the whole text in memory
+    with get_http_session().get(url, stream=True, timeout=30) as response:
+        response.raise_for_status()  # Raise an exception for bad status codes
+        response.raw.decode_content = True  # Undo any gzip/deflate content encoding while streaming
+        response.raw.auto_close = False  # Report end of file as an empty read so BufferedReader doesn't see a closed file
+        return parse_csv_data(BufferedReader(response.raw, buffer_size=CSV_SNIFF_BYTES))
+
+# Function to parse and clean the CSV data
+def parse_csv_data(stream):
+    """Parse the CSV in the buffered binary stream and return a DataFrame of the valid tweet_content/summary rows and whether its columns were renamed."""
+    # Sniff the delimiter from the start of the file, without consuming it, so the fast parsers can be used
+    sample = stream.peek(CSV_SNIFF_BYTES)[:CSV_SNIFF_BYTES].decode('utf-8', 'replace')
+    try:
+        sep = csv.Sniffer().sniff(sample, delimiters=',\t|;').delimiter
+    except csv.Error:
+        sep = None
+    
+    # Only parse the two needed columns when the header names them, otherwise they are renamed below
+    usecols = None
+    if sep is not None:
+        header = next(csv.reader(sample.splitlines()[:1], delimiter=sep), [])
+        if set(DATA_COLUMNS) <= set(header):
+            usecols = DATA_COLUMNS
+    
+    # Load the CSV data from the stream, falling back to the sniffing Python parser
+    if sep is not None and pa_csv is not None:
+        # Arrow-backed columns are multithreaded to parse and much smaller to keep in session state.
+        # Tweets can contain newlines inside quoted fields, which pyarrow only accepts when told to.
+        table = pa_csv.read_csv(
+            stream,
+            parse_options=pa_csv.ParseOptions(delimiter=sep, newlines_in_values=True),
+            convert_options=pa_csv.ConvertOptions(include_columns=usecols)
+        )
+        df = table.to_pandas(types_mapper=pd.ArrowDtype)
+    elif sep is not None:
+        # pyarrow is not installed, use the C parser instead
+        df = pd.read_csv(
+            stream,
+            sep=sep,
+            engine='c',
+            usecols=usecols,
+            dtype=dict.fromkeys(DATA_COLUMNS, 'string')
+        )
+    else:
+        df = pd.read_csv(stream, sep=None, engine='python')
+    
+    # Check if the column names match expected names
+    renamed_columns = not set(DATA_COLUMNS) <= set(df.columns)
+    if renamed_columns:
+        # Try to adapt to the actual column names if they exist but are named differently
+        if len(df.columns) >= 2:
+            df.columns = DATA_COLUMNS
+        else:
+            raise ValueError(f"Expected {' and '.join(map(repr, DATA_COLUMNS))} columns but found: {df.columns.tolist()}")
+    
+    # Store the text as Arrow strings when pyarrow is available, so the string operations below run as Arrow kernels
+    try:
+        string_dtype = pd.StringDtype('pyarrow')
+    except ImportError:
+        string_dtype = pd.StringDtype()
+    
+    # Filter out rows with empty or problematic content, stripping each column only once
+    tweets = df['tweet_content'].astype(string_dtype).str.strip()
+    summaries = df['summary'].astype(string_dtype).str.strip()
+    mask = tweets.notna() & tweets.ne('') & summaries.notna() & summaries.ne('')
+    
+    # Keep the stripped text so callers don't need to strip again
+    df = pd.DataFrame({'tweet_content': tweets[mask], 'summary': summaries[mask]}).reset_index(drop=True)
+    
+    # Dictionary-encode columns that are mostly repeated values
+    for column in DATA_COLUMNS:
+        if len(df) > 0 and df[column].nunique() / len(df) < 0.5:
+            df[column] = df[column].astype('category')
+    
+    return df, renamed_columns
+
+# Function to get the version of the remote CSV without downloading it
+def fetch_data_version(url):
+    """Return the ETag/Last-Modified headers for url, or None if the server sends neither or can't be reached."""
+    try:
+        response = get_http_session().head(url, timeout=10, allow_redirects=True)
+        response.raise_for_status()
+    except requests.RequestException:
+        return None
+    version = {header: response.headers.get(header) for header in ('ETag', 'Last-Modified')}
+    return version if any(version.values()) else None
+
+# Function to load the data, cached in memory per URL and as Parquet on disk
+@st.cache_data(ttl=DATA_CACHE_TTL, show_spinner=False)
+def load_data(url):
+    """Return the cleaned data for url and whether its columns were renamed, reading the Parquet cache while the remote file is unchanged and refreshing it otherwise."""
+    cache_path = DATA_CACHE_DIR / f"{hashlib.sha1(url.encode()).hexdigest()}.parquet"
+    meta_path = cache_path.with_suffix('.meta')
+    version = fetch_data_version(url)
+    
+    if cache_path.exists():
+        try:
+            meta = json.loads(meta_path.read_text())
+        except (OSError, ValueError):
+            meta = None
+        
+        # Trust the on-disk copy if the server reports the same version, or within the TTL when it reports none
+        if not isinstance(meta, dict):
+            fresh = False
+        elif version is not None:
+            fresh = meta.get('version') == version
+        else:
+            fresh = time.time() - cache_path.stat().st_mtime < DATA_CACHE_TTL
+        
+        if fresh:
+            try:
+                return pd.read_parquet(cache_path, columns=DATA_COLUMNS), meta.get('renamed_columns', False)
+            except Exception:
+                # Unreadable or written by an incompatible version, fall through and rebuild it
+                pass
+    
+    df, renamed_columns = fetch_csv_data(url)
+    
+    # Persisting is best effort: a read-only home or missing Parquet engine shouldn't break loading
+    try:
+        DATA_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(cache_path, compression='zstd')
+        meta_path.write_text(json.dumps({'version': version, 'renamed_columns': renamed_columns}))
+    except Exception:
+        pass
+    
+    return df, renamed_columns
+
+# Function to load the data and check the API key concurrently
+async def warm_up(url, api_key):
+    """Load the data for url while verifying api_key, returning the load_data result and the key error if the check failed."""
+    client = anthropic.AsyncAnthropic(api_key=api_key)
+    try:
+        data, key_check = await asyncio.gather(
+            asyncio.to_thread(load_data, url),
+            client.with_options(timeout=KEY_CHECK_TIMEOUT, max_retries=0).models.list(),
+            return_exceptions=True
+        )
+    finally:
+        await client.close()
+    
+    # A data error should fail the load, while a key error is only reported
+    if isinstance(data, BaseException):
+        raise data
+    return data, key_check if isinstance(key_check, Exception) else None
+
+# Function to build the display text for the context examples
+@st.cache_data(ttl=HISTORY_CACHE_TTL, max_entries=HISTORY_CACHE_MAX_ENTRIES, show_spinner=False)
+def build_history_text(samples):
+    """Return the User/Assistant transcript text for a tuple of (tweet, summary) samples."""
+    return "".join(f"User: {tweet}\nAssistant: {summary}{EXAMPLE_SEPARATOR}" for tweet, summary in samples)
+
+# Function to display the chat history
+def render_transcript(chat_history):
+    """Render every (user, assistant) exchange as a single markdown element rather than one per message."""
+    if chat_history:
+        st.markdown("".join(
+            f"**User:**\n{user_msg}\n\n**Assistant:**\n{ai_msg}\n\n---\n\n" for user_msg, ai_msg in chat_history
+        ))
+
+# Function to clear the chat, run as a button callback so it needs no rerun of its own
+def clear_chat():
+    """Forget every exchange in the chat history."""
+    st.session_state.chat_history = []
+
+# Chat interface, run as a fragment so sending or clearing messages only reruns the chat
+@st.fragment
+def chat_fragment(api_key):
+    """Render the chat transcript and input, and answer submitted posts."""
+    st.header("Chat Interface")
+    
+    # Display chat history
+    chat_container = st.container()
+    with chat_container:
+        render_transcript(st.session_state.chat_history)
+    
+    # User input, in a form that clears the input area once submitted
+    with st.form("chat_form", clear_on_submit=True, border=False):
+        user_input = st.text_area("Enter your post or tweet:", height=100)
+        send_button = st.form_submit_button("Submit")
+    st.button("Clear Chat", on_click=clear_chat)
+    
+    if send_button and user_input and api_key:
+        try:
+            client = get_client(api_key)
+            
+            # Get AI response using the example messages, rendering it at the end of the chat as it streams in.
+            # The streamed exchange stays on screen, and the next run renders it from the history instead.
+            with chat_container:
+                st.markdown(f"**User:**\n{user_input}")
+                st.markdown("**Assistant:**")
+                placeholder = st.empty()
+            ai_response = call_claude_api(client, user_input, st.session_state.history_messages, placeholder)
+            
+            # Add the exchange to chat history
+            st.session_state.chat_history.append((user_input, ai_response))
+            
+        except Exception as e:
+            st.error(f"Error: {str(e)}")
+    
+    # Warning if API key is missing
+    if send_button and not api_key:
+        st.warning("Please enter your Anthropic API key in the sidebar to use the chat functionality.")
+
 # Main app function
 def main():
     # Title and introduction
@@ -108,6 +556,9 @@ def main():
     # Number of context examples to load
     num_context_examples = st.sidebar.slider("Number of random examples", min_value=0, max_value=100, value=5)
     
+    # Optional seed to make the example selection reproducible
+    example_seed = st.sidebar.number_input("Random seed (optional)", value=None, min_value=0, step=1)
+    
     # Data source settings
     st.sidebar.header("Data Source")
     data_url = st.sidebar.text_input(
@@ -116,48 +567,35 @@ def main():
     )
     
     # Button to load/reload data
-    load_data = st.sidebar.button("Load/Reload Data")
+    reload_data = st.sidebar.button("Load/Reload Data")
+    
+    # Initialize session state for context examples and chat
+    if 'samples' not in st.session_state:
+        st.session_state.samples = []
     
-    # Initialize session state for conversation history and chat
-    if 'conversation_history' not in st.session_state:
-        st.session_state.conversation_history = ""
+    if 'history_messages' not in st.session_state:
+        st.session_state.history_messages = []
     
     if 'chat_history' not in st.session_state:
         st.session_state.chat_history = []
     
+    if 'rng' not in st.session_state:
+        st.session_state.rng = np.random.default_rng()
+    
     # Initialize the DataFrame in session state
-    if 'df' not in st.session_state or load_data:
+    if 'df' not in st.session_state or reload_data:
         try:
             with st.spinner("Downloading and loading data..."):
-                # Download and load the CSV file from URL
-                response = requests.get(data_url)
-                response.raise_for_status()  # Raise an exception for bad status codes
-                
-                # Load the CSV data from the response content
-                csv_data = StringIO(response.text)
-                df = pd.read_csv(csv_data, sep=None, engine='python')
-                
-                # Check if the column names match expected names
-                if 'tweet_content' not in df.columns or 'summary' not in df.columns:
-                    # Try to adapt to the actual column names if they exist but are named differently
-                    if len(df.columns) >= 2:
-                        df.columns = ['tweet_content', 'summary']
-                        st.success(f"Renamed columns to 'tweet_content' and 'summary'")
-                    else:
-                        st.error(f"Error: Expected 'tweet_content' and 'summary' columns but found: {df.columns.tolist()}")
-                        return
-                
-                # Filter out rows with empty or problematic content
-                valid_df = df[
-                    (df['tweet_content'].notna()) & 
-                    (df['tweet_content'].str.strip() != '') &
-                    (df['summary'].notna()) & 
-                    (df['summary'].str.strip() != '')
-                ].copy()
-                
-                st.session_state.df = valid_df
-                st.success(f"Successfully loaded {len(valid_df)} valid rows from data")
-                
+                if api_key:
+                    # Overlap the download with a check of the API key
+                    (st.session_state.df, renamed_columns), key_error = asyncio.run(warm_up(data_url, api_key))
+                    if key_error is not None:
+                        st.sidebar.error(f"Could not verify API key: {str(key_error)}")
+                else:
+                    st.session_state.df, renamed_columns = load_data(data_url)
+            if renamed_columns:
+                st.success(f"Renamed columns to {' and '.join(map(repr, DATA_COLUMNS))}")
+            st.success(f"Successfully loaded {len(st.session_state.df)} valid rows from data")
         except Exception as e:
             st.error(f"Error loading data: {str(e)}")
             st.session_state.df = None
@@ -168,71 +606,124 @@ def main():
             with st.spinner(f"Selecting {num_context_examples} random examples..."):
                 # Select random rows for context
                 n = min(num_context_examples, len(st.session_state.df))
-                random_indices = random.sample(range(len(st.session_state.df)), n)
-                selected_rows = st.session_state.df.iloc[random_indices]
+                random_state = int(example_seed) if example_seed is not None else st.session_state.rng
+                selected_rows = st.session_state.df.sample(n=n, random_state=random_state).reset_index(drop=True)
                 
-                # Generate conversation history from selected rows
-                conversation_history = ""
-                for _, row in selected_rows.iterrows():
-                    tweet = row['tweet_content'].strip()
-                    summary = row['summary'].strip()
-                    
-                    # Skip if either part is empty after stripping
-                    if not tweet or not summary:
-                        continue
-                        
-                    conversation_history += f"User: {tweet}\nAssistant: {summary}\n{'-' * 80}\n"
+                # Drop overly long examples, then keep examples in order while they fit in the total budget
+                example_chars = selected_rows['tweet_content'].str.len() + selected_rows['summary'].str.len()
+                fits = example_chars <= MAX_EXAMPLE_CHARS
+                selected_rows = selected_rows[fits]
+                selected_rows = selected_rows[example_chars[fits].cumsum() <= MAX_EXAMPLES_TOTAL_CHARS]
                 
-                st.session_state.conversation_history = conversation_history
-                st.success(f"Generated {n} new context examples")
+                # Keep the examples as (tweet, summary) records (already stripped and non-empty from load_data)
+                st.session_state.samples = list(zip(selected_rows['tweet_content'].tolist(), selected_rows['summary'].tolist()))
+                
+                # Build the API messages directly from the records
+                history_messages = []
+                for tweet, summary in st.session_state.samples:
+                    history_messages.append({"role": "user", "content": tweet})
+                    history_messages.append({"role": "assistant", "content": summary})
+                st.session_state.history_messages = history_messages
+                st.success(f"Generated {len(selected_rows)} new context examples")
+    
+    # Show how many examples are actually sent after applying the budgets
+    if st.session_state.samples:
+        st.sidebar.caption(f"Using {len(st.session_state.samples)} context examples")
+        
+        # Generate notes for every sampled post at once, shown in the Sample Notes tab.
+        # Batch mode uses the Message Batches API, which costs about half as much but can take minutes.
+        batch_mode = st.sidebar.toggle("Batch mode (cheaper, slower)")
+        poll_interval = BATCH_POLL_INTERVAL
+        if batch_mode:
+            poll_interval = st.sidebar.number_input("Batch poll interval (seconds)", min_value=1, value=BATCH_POLL_INTERVAL)
+        
+        # A batch submitted on an earlier run is resumed rather than submitted again
+        sample_batch_pending = pending_note_batch('sample_batch_job', api_key)
+        if sample_batch_pending:
+            st.sidebar.button("Cancel pending batch", key="cancel_sample_batch", on_click=forget_note_batch, args=('sample_batch_job', api_key))
+        if st.sidebar.button("Analyze All Samples") or sample_batch_pending:
+            if not api_key:
+                st.sidebar.warning("Please enter your Anthropic API key to analyze samples.")
+            else:
+                try:
+                    tweets = [tweet for tweet, _ in st.session_state.samples]
+                    progress = st.sidebar.progress(0.0, text="Analyzing samples...")
+                    if batch_mode or sample_batch_pending:
+                        if not sample_batch_pending:
+                            st.session_state.sample_batch_references = [summary for _, summary in st.session_state.samples]
+                        tweets, notes = run_note_batch(
+                            get_client(api_key), 'sample_batch_job', tweets,
+                            poll_interval=poll_interval, on_progress=progress.progress
+                        )
+                        references = st.session_state.sample_batch_references
+                    else:
+                        notes = asyncio.run(analyze_batch(tweets, api_key, on_progress=progress.progress))
+                        references = [summary for _, summary in st.session_state.samples]
+                    progress.empty()
+                    st.session_state.sample_notes = pd.DataFrame({
+                        "post": tweets,
+                        "reference note": references,
+                        "generated note": notes
+                    })
+                except Exception as e:
+                    st.sidebar.error(f"Error: {str(e)}")
     
-    # Display the context examples in a collapsible section
-    if st.session_state.conversation_history:
+    # Display the context examples in a collapsible section, building the text from the samples only here
+    if st.session_state.samples:
         with st.expander("View Context Examples"):
-            st.text(st.session_state.conversation_history)
+            st.text(build_history_text(tuple(st.session_state.samples)))
     
-    # Main chat interface
-    st.header("Chat Interface")
+    chat_tab, bulk_tab, sample_notes_tab = st.tabs(["Chat", "Bulk Analyze", "Sample Notes"])
     
-    # Display chat history
-    chat_container = st.container()
-    with chat_container:
-        for i, (user_msg, ai_msg) in enumerate(st.session_state.chat_history):
-            st.markdown(f"**User:**\n{user_msg}")
-            st.markdown(f"**Assistant:**\n{ai_msg}")
-            st.markdown("---")
-    
-    # User input
-    user_input = st.text_area("Enter your post or tweet:", height=100)
-    col1, col2 = st.columns([1, 5])
-    with col1:
-        send_button = st.button("Submit")
-    with col2:
-        if st.button("Clear Chat"):
-            st.session_state.chat_history = []
-            st.rerun()
+    # Main chat interface
+    with chat_tab:
+        chat_fragment(api_key)
     
-    if send_button and user_input and api_key:
-        try:
-            # Initialize the Anthropic client
-            client = anthropic.Anthropic(api_key=api_key)
-            
-            # Get AI response using the conversation history
-            with st.spinner("Generating response..."):
-                ai_response = call_claude_api(client, user_input, st.session_state.conversation_history)
-            
-            # Add the exchange to chat history
-            st.session_state.chat_history.append((user_input, ai_response))
-            
-            # Clear the input area and rerun to update the UI
-            st.rerun()
-            
-        except Exception as e:
-            st.error(f"Error: {str(e)}")
+    # Bulk analysis through the Message Batches API, which is cheaper but not interactive
+    with bulk_tab:
+        st.header("Bulk Analyze")
+        st.markdown("""
+        Paste several posts separated by a blank line. They are sent together as one Message Batch, 
+        which costs less than individual requests but can take several minutes to complete.
+        """)
+        
+        bulk_input = st.text_area("Posts to analyze:", height=200)
+        analyze_button = st.button("Analyze Posts")
+        
+        # A batch submitted on an earlier run is resumed rather than submitted again
+        bulk_batch_pending = pending_note_batch('bulk_batch_job', api_key)
+        if bulk_batch_pending:
+            st.button("Cancel pending batch", key="cancel_bulk_batch", on_click=forget_note_batch, args=('bulk_batch_job', api_key))
+        if analyze_button or bulk_batch_pending:
+            posts = [post.strip() for post in re.split(r"\n\s*\n", bulk_input) if post.strip()]
+            if not api_key:
+                st.warning("Please enter your Anthropic API key in the sidebar to use bulk analysis.")
+            elif not posts and not bulk_batch_pending:
+                st.warning("Please enter at least one post to analyze.")
+            else:
+                try:
+                    # Update a progress bar while polling so a click on Cancel can interrupt the wait
+                    progress = st.progress(0.0, text="Waiting for the Message Batch to finish...")
+                    posts, notes = run_note_batch(
+                        get_client(api_key), 'bulk_batch_job', posts, st.session_state.history_messages,
+                        on_progress=progress.progress
+                    )
+                    progress.empty()
+                    st.session_state.bulk_results = pd.DataFrame({"post": posts, "note": notes})
+                except Exception as e:
+                    st.error(f"Error: {str(e)}")
+        
+        # Display the latest batch results
+        if st.session_state.get('bulk_results') is not None:
+            st.dataframe(st.session_state.bulk_results, width="stretch")
     
-    # Warning if API key is missing
-    if send_button and not api_key:
-        st.warning("Please enter your Anthropic API key in the sidebar to use the chat functionality.")
+    # Notes generated for the sampled context examples
+    with sample_notes_tab:
+        st.header("Sample Notes")
+        if st.session_state.get('sample_notes') is not None:
+            st.dataframe(st.session_state.sample_notes, width="stretch")
+        else:
+            st.info("Generate context examples and click \"Analyze All Samples\" in the sidebar to compare notes.")
 
 if __name__ == "__main__":
     main()
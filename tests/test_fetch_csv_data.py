@@ -0,0 +1,39 @@
+import gzip
+import http.server
+import threading
+
+import pytest
+
+import app
+
+CSV_DATA = b"tweet_content,summary\n" + b"".join(b"tweet %d,note %d\n" % (i, i) for i in range(1000))
+
+
+@pytest.fixture
+def csv_server():
+    """Serve CSV_DATA over HTTP, gzip-encoded when the path ends in .gz."""
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = gzip.compress(CSV_DATA) if self.path.endswith(".gz") else CSV_DATA
+            self.send_response(200)
+            if self.path.endswith(".gz"):
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, *args):
+            pass
+    
+    server = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+@pytest.mark.parametrize("path", ["/data.csv", "/data.csv.gz"])
+def test_fetch_csv_data_streams_whole_response(csv_server, path):
+    df, renamed_columns = app.fetch_csv_data(csv_server + path)
+    
+    assert len(df) == 1000
+    assert df['tweet_content'].iloc[-1] == "tweet 999"
@@ -0,0 +1,32 @@
+from io import BufferedReader, BytesIO
+
+import pytest
+
+import app
+
+CSV_WITH_QUOTED_NEWLINE = (
+    b'tweet_content,summary\n'
+    b'"first line\nsecond line",A note\n'
+    b'plain tweet,Another note\n'
+)
+
+
+@pytest.mark.parametrize("use_pyarrow", [True, False])
+def test_quoted_newline_in_tweet_content(monkeypatch, use_pyarrow):
+    if use_pyarrow and app.pa_csv is None:
+        pytest.skip("pyarrow is not installed")
+    if not use_pyarrow:
+        monkeypatch.setattr(app, "pa_csv", None)
+    
+    df, renamed_columns = app.parse_csv_data(BufferedReader(BytesIO(CSV_WITH_QUOTED_NEWLINE)))
+    
+    assert not renamed_columns
+    assert df['tweet_content'].tolist() == ["first line\nsecond line", "plain tweet"]
+    assert df['summary'].tolist() == ["A note", "Another note"]
+
+
+def test_other_column_names_are_renamed():
+    df, renamed_columns = app.parse_csv_data(BufferedReader(BytesIO(b"post,note\nsome tweet,some note\n")))
+    
+    assert renamed_columns
+    assert df.columns.tolist() == ['tweet_content', 'summary']
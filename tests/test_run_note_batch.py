@@ -0,0 +1,127 @@
+from types import SimpleNamespace
+
+import anthropic
+import pytest
+
+import app
+
+
+class FakeBatches:
+    """Stand-in for client.messages.batches that ends every batch after polls_until_ended retrieves."""
+
+    def __init__(self, polls_until_ended=0, retrieve_error=None):
+        self.polls_until_ended = polls_until_ended
+        self.retrieve_error = retrieve_error
+        self.created = []
+        self.retrieves = 0
+
+    def create(self, requests):
+        self.created.append(requests)
+        return SimpleNamespace(id=f"batch-{len(self.created)}")
+
+    def retrieve(self, batch_id):
+        if self.retrieve_error is not None:
+            raise self.retrieve_error
+        self.retrieves += 1
+        status = "ended" if self.retrieves > self.polls_until_ended else "in_progress"
+        return SimpleNamespace(id=batch_id, processing_status=status, request_counts=SimpleNamespace(processing=1))
+
+    def results(self, batch_id):
+        for request in self.created[-1]:
+            message = SimpleNamespace(content=[SimpleNamespace(text=f"note for {request['params']['messages'][-1]['content']}")])
+            yield SimpleNamespace(custom_id=request["custom_id"], result=SimpleNamespace(type="succeeded", message=message))
+
+
+def fake_client(batches, api_key="key"):
+    return SimpleNamespace(api_key=api_key, messages=SimpleNamespace(batches=batches))
+
+
+def status_error(status_code):
+    response = SimpleNamespace(request=None, status_code=status_code, headers={})
+    if status_code == 404:
+        return anthropic.NotFoundError("not found", response=response, body=None)
+    return anthropic.InternalServerError("server error", response=response, body=None)
+
+
+@pytest.fixture(autouse=True)
+def session_state(monkeypatch):
+    """Give each test an empty session state and note cache."""
+    state = {}
+    monkeypatch.setattr(app.st, "session_state", state)
+    app.get_note_cache.clear()
+    yield state
+    app.get_note_cache.clear()
+
+
+def test_submits_posts_and_clears_the_job(session_state):
+    batches = FakeBatches()
+
+    posts, notes = app.run_note_batch(fake_client(batches), "job", ["one", "two"], poll_interval=0)
+
+    assert posts == ["one", "two"]
+    assert notes == ["note for one", "note for two"]
+    assert len(batches.created) == 1
+    assert "job" not in session_state
+
+
+def test_resumes_the_submitted_batch_after_a_rerun(session_state):
+    batches = FakeBatches(polls_until_ended=1)
+
+    # Interrupt the first run while it waits, as a rerun would
+    def interrupt(fraction):
+        raise KeyboardInterrupt
+    with pytest.raises(KeyboardInterrupt):
+        app.run_note_batch(fake_client(batches), "job", ["one", "two"], poll_interval=0, on_progress=interrupt)
+    assert "job" in session_state
+
+    # The rerun may no longer have the posts, the job remembers them
+    posts, notes = app.run_note_batch(fake_client(batches), "job", [], poll_interval=0)
+
+    assert posts == ["one", "two"]
+    assert notes == ["note for one", "note for two"]
+    assert len(batches.created) == 1
+    assert "job" not in session_state
+
+
+def test_permanent_failure_clears_the_job(session_state):
+    batches = FakeBatches(retrieve_error=status_error(404))
+    session_state["job"] = {
+        "posts": ["one"], "keys": ["k"], "notes": {}, "batch_id": "batch-1", "size": 1,
+        "key_hash": app.api_key_hash("key")
+    }
+
+    with pytest.raises(Exception, match="Batch request failed"):
+        app.run_note_batch(fake_client(batches), "job", [], poll_interval=0)
+
+    assert "job" not in session_state
+
+
+def test_transient_failure_keeps_the_job(session_state):
+    batches = FakeBatches(retrieve_error=status_error(500))
+    job = {
+        "posts": ["one"], "keys": ["k"], "notes": {}, "batch_id": "batch-1", "size": 1,
+        "key_hash": app.api_key_hash("key")
+    }
+    session_state["job"] = job
+
+    with pytest.raises(Exception, match="Batch request failed"):
+        app.run_note_batch(fake_client(batches), "job", [], poll_interval=0)
+
+    assert session_state["job"] is job
+
+
+def test_job_under_another_key_is_forgotten(session_state):
+    session_state["job"] = {"batch_id": "batch-1", "key_hash": app.api_key_hash("old key")}
+
+    assert not app.pending_note_batch("job", "new key")
+    assert "job" not in session_state
+
+
+def test_cached_posts_are_not_submitted(session_state):
+    batches = FakeBatches()
+    app.store_note(app.request_cache_key(app.build_request_params("one")), "cached note")
+
+    posts, notes = app.run_note_batch(fake_client(batches), "job", ["one", "two"], poll_interval=0)
+
+    assert notes == ["cached note", "note for two"]
+    assert [request["custom_id"] for request in batches.created[0]] == ["post-1"]